@@ -9,6 +9,10 @@ import shlex
 import signal
 import json
 import argparse
+import hashlib
+import socket
+import errno
+import fcntl
 
 all_patts = ['all', '*']
 
@@ -23,10 +27,49 @@ jobs_cv = threading.Condition(threading.Lock())
 running_jobs_table = {} # map pid -> (job_id, command)
 running_cv = threading.Condition(threading.Lock())
 
+running_procs = {} # map pid -> Popen object (so we can reap and get return codes)
+reap_q = Queue.Queue() # SIGCHLD handler -> reaper thread wakeups
+# python only runs signal handlers on the main thread, which is usually
+# blocked opening the pipe, so the reaper also polls on its own
+reap_interval = 0.5 # seconds
+
+# job ids are '<manager id>:<sequence #>' so they are unique across the
+# cluster; the sequence # is persisted so a restart doesn't reuse ids
+manager_id = None # set in main, see default_manager_id
+job_id_file = 'jobs.seq'
 current_job_id = 0
 commands_q = Queue.Queue()
 
+# result memoization: map memo key -> record of a successful completion.
+# only consulted for submissions that ask for it (--memoize on the client)
+cache_file = 'results.cache'
+cache_max_entries = 10000
+cache_max_age = 7 * 24 * 60 * 60 # seconds
+results_cache = {}
+inflight_jobs = {} # map memo key -> job_id of identical job queued or running
+cache_stats = {'cache_hits': 0, 'coalesced': 0}
+cache_lock = threading.Lock()
+# digests of declared input files, keyed by (path, size, mtime), so a
+# big dataset isn't re-hashed on every submission that names it
+max_digests = 1000
+file_digests = {}
+digests_lock = threading.Lock()
+
+# recently finished jobs, so stat-by-id can report how a job ended;
+# persisted so this survives restarts
+finished_file = 'jobs.finished'
+max_finished_jobs = 1000
+finished_jobs = {} # map job_id -> job (with returncode and finish time)
+
 saturated = threading.Condition(threading.Lock())
+persist_lock = threading.Lock() # serializes writes of state files
+
+# the command thread rewrites the heartbeat file every heartbeat_interval
+# seconds, so clients can tell a wedged or dead manager from a slow one
+heartbeat_interval = 5. # seconds
+reply_timeout = 10. # max seconds to wait for a client to open its port
+stopping = threading.Event() # tells the command and reaper threads to wind down
+last_beat = 0
 
 # ref: http://stackoverflow.com/questions/568271/how-to-check-if-there-exists-a-process-with-a-given-pid
 def check_pid(pid):
@@ -39,30 +82,310 @@ def check_pid(pid):
         return True
 
 def sigchld_handler(signum, frame):
+    # this means that a subprocess executed. the main thread may be
+    # holding any lock when this runs, so all it does is wake the
+    # reaper thread to do the bookkeeping
+    reap_q.put(True)
+
+def reap_jobs():
     global jobs_running
-    # this means that a subprocess executed,
-    # so we decrement the jobs_running variable
-    todelete = []
-    saturated.acquire()
-    # this avoids race where multiple SIGCHLDs are delivered --
-    # since we only execute one handler for potentially multiple
-    # signals, we need to check all running jobs to see whether
-    # they are still around
-    for pid in running_jobs_table:
-        if not check_pid(pid):
-            todelete.add(pid)
-    for pid in todelete:
-        del running_jobs_table[pid]
-    jobs_running = len(running_jobs_table)
-    saturated.notify()
-    saturated.release()
+    while not stopping.is_set():
+        try:
+            reap_q.get(block=True, timeout=reap_interval)
+        except Queue.Empty:
+            pass
+        # several SIGCHLDs may be behind one check, so drain them all
+        while not reap_q.empty():
+            reap_q.get_nowait()
+        todelete = []
+        finished = []
+        saturated.acquire()
+        # we need to check all running jobs to see whether
+        # they are still around
+        for pid in running_jobs_table:
+            # poll() reaps the child if it exited; a zombie would
+            # otherwise still pass check_pid
+            proc = running_procs.get(pid)
+            if proc is not None and proc.poll() is not None:
+                finished.append((running_jobs_table[pid], proc.returncode))
+                todelete.append(pid)
+            elif proc is None and not check_pid(pid):
+                todelete.append(pid)
+        # recorded before leaving saturated so that a job is always
+        # visible as either running or finished
+        results_changed = False
+        cache_lock.acquire()
+        for job, returncode in finished:
+            results_changed = record_job_finished(job, returncode) or results_changed
+        cache_lock.release()
+        for pid in todelete:
+            del running_jobs_table[pid]
+            running_procs.pop(pid, None)
+        jobs_running = len(running_jobs_table)
+        saturated.notify()
+        saturated.release()
+        # disk writes happen without holding saturated or cache_lock
+        if len(finished) > 0:
+            save_finished_jobs()
+        if results_changed:
+            save_cache()
+
+def run_prehook(args):
+    # a 'git pull' or 'make' can take a while; keep beating so clients
+    # don't take a busy manager for a wedged one
+    proc = subprocess.Popen(args)
+    while proc.poll() is None:
+        beat_if_due()
+        time.sleep(0.1)
 
 def prehooks(cmd_json):
     if cmd_json['git']:
-        subprocess.call(shlex.split('git pull'))
+        run_prehook(shlex.split('git pull'))
 
     if cmd_json['make']:
-        subprocess.call(['make'])
+        run_prehook(['make'])
+
+def git_revision():
+    try:
+        proc = subprocess.Popen(shlex.split('git rev-parse HEAD'),
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, _ = proc.communicate()
+    except OSError:
+        return None
+    if proc.returncode != 0:
+        return None
+    return out.strip()
+
+def hash_file(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    digest_key = (os.path.abspath(path), st.st_size, st.st_mtime)
+    digests_lock.acquire()
+    digest = file_digests.get(digest_key)
+    digests_lock.release()
+    if digest is not None:
+        return digest
+    h = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                h.update(chunk)
+    except IOError:
+        return None
+    digest = h.hexdigest()
+    digests_lock.acquire()
+    if len(file_digests) >= max_digests:
+        file_digests.clear()
+    file_digests[digest_key] = digest
+    digests_lock.release()
+    return digest
+
+def memo_hint(command, revision):
+    # cheap stand-in for the memo key (no input files hashed), only used
+    # to tell 'submit any' which manager is likely to have a result
+    h = hashlib.sha1()
+    h.update(json.dumps({'run': command['run'].strip(), 'revision': revision}, sort_keys=True))
+    return h.hexdigest()
+
+def memo_key(command, revision):
+    # key is the command string, the revision the project is at
+    # (after the --git prehook pulled, if requested), and the
+    # contents of any declared input files. returns None if there
+    # is no revision to key on, since then a stale result can't be
+    # told apart from a current one
+    if revision is None:
+        return None
+    h = hashlib.sha1()
+    h.update(json.dumps({'run': command['run'].strip(),
+                         'revision': revision,
+                         'inputs': [(path, hash_file(path)) for path in sorted(command.get('inputs', []))],
+                         }, sort_keys=True))
+    return h.hexdigest()
+
+def evict_cache(now=None):
+    # caller must hold cache_lock
+    if now is None:
+        now = time.time()
+    for key in list(results_cache.keys()):
+        if now - results_cache[key]['completed'] > cache_max_age:
+            del results_cache[key]
+    if len(results_cache) > cache_max_entries:
+        oldest_first = sorted(results_cache, key=lambda k: results_cache[k]['completed'])
+        for key in oldest_first[:len(results_cache) - cache_max_entries]:
+            del results_cache[key]
+
+def load_cache():
+    global results_cache
+    global cache_stats
+    if not os.path.exists(cache_file):
+        return
+    try:
+        with open(cache_file, 'r') as f:
+            saved = json.load(f)
+    except (IOError, ValueError) as e:
+        sys.stderr.write("warning: could not load result cache %s: %s\n" % (cache_file, str(e)))
+        return
+    cache_lock.acquire()
+    results_cache = saved.get('results', {})
+    cache_stats.update(saved.get('stats', {}))
+    evict_cache()
+    cache_lock.release()
+
+def write_atomically(path, contents):
+    tmp_name = path + '.tmp'
+    with open(tmp_name, 'w') as f:
+        f.write(contents)
+    os.rename(tmp_name, path) # atomic, so a crash can't leave a torn file
+
+def save_cache():
+    # snapshot under cache_lock, write without it. persist_lock keeps
+    # an older snapshot from being written over a newer one
+    persist_lock.acquire()
+    cache_lock.acquire()
+    contents = json.dumps({'results': results_cache, 'stats': cache_stats})
+    cache_lock.release()
+    try:
+        write_atomically(cache_file, contents)
+    except (IOError, OSError) as e:
+        sys.stderr.write("warning: could not save result cache %s: %s\n" % (cache_file, str(e)))
+    persist_lock.release()
+
+def save_finished_jobs():
+    persist_lock.acquire()
+    cache_lock.acquire()
+    contents = json.dumps(finished_jobs)
+    cache_lock.release()
+    try:
+        write_atomically(finished_file, contents)
+    except (IOError, OSError) as e:
+        sys.stderr.write("warning: could not save finished jobs %s: %s\n" % (finished_file, str(e)))
+    persist_lock.release()
+
+def default_manager_id():
+    # several managers may share a host (in different project roots), so
+    # the hostname alone isn't unique; tell them apart by where their pipe is
+    pipe_path = os.path.abspath(pipe_name)
+    return '%s-%s' % (socket.gethostname(), hashlib.sha1(pipe_path).hexdigest()[:8])
+
+def next_job_id():
+    # caller must hold jobs_cv
+    global current_job_id
+    jid = '%s:%d' % (manager_id, current_job_id)
+    current_job_id += 1
+    try:
+        write_atomically(job_id_file, str(current_job_id))
+    except (IOError, OSError) as e:
+        sys.stderr.write("warning: could not save job id sequence to %s: %s\n" % (job_id_file, str(e)))
+    return jid
+
+def load_job_id():
+    global current_job_id
+    if not os.path.exists(job_id_file):
+        return
+    # starting over at 0 would reuse job ids, so rather than guess, die
+    # and let whoever is starting us sort out the sequence file
+    with open(job_id_file, 'r') as f:
+        current_job_id = int(f.read().strip())
+
+def load_finished_jobs():
+    global finished_jobs
+    if not os.path.exists(finished_file):
+        return
+    try:
+        with open(finished_file, 'r') as f:
+            saved = json.load(f)
+    except (IOError, ValueError) as e:
+        sys.stderr.write("warning: could not load finished jobs %s: %s\n" % (finished_file, str(e)))
+        return
+    cache_lock.acquire()
+    finished_jobs = saved
+    cache_lock.release()
+
+def find_finished_job(job_id):
+    # caller must hold cache_lock. jobs that fell out of finished_jobs may
+    # still be known as the job behind a memoized result
+    if job_id in finished_jobs:
+        return finished_jobs[job_id]
+    for result in results_cache.values():
+        if result['job_id'] == job_id:
+            return {'job_id': job_id, 'job': result['job'], 'returncode': 0,
+                    'finished': result['completed']}
+    return None
+
+def record_job_finished(job, returncode):
+    # caller must hold cache_lock; only updates memory (see reap_jobs).
+    # returns whether the result cache changed
+    finished = dict(job)
+    finished['returncode'] = returncode
+    finished['finished'] = time.time()
+    finished_jobs[job['job_id']] = finished
+    if len(finished_jobs) > max_finished_jobs:
+        oldest = min(finished_jobs, key=lambda jid: finished_jobs[jid]['finished'])
+        del finished_jobs[oldest]
+    key = job.get('memo_key')
+    if key is None:
+        return False
+    if inflight_jobs.get(key) == job['job_id']:
+        del inflight_jobs[key]
+    if returncode == 0:
+        results_cache[key] = {'job_id': job['job_id'], 'job': job['job'],
+                              'hint': job.get('memo_hint'), 'completed': time.time()}
+        evict_cache()
+        return True
+    return False
+
+def reply(command, ret):
+    # a nonblocking open of a fifo for writing fails with ENXIO until
+    # the reader opens it; poll for that rather than blocking forever
+    # (and wedging the command thread) if the client has gone away
+    # echoed back so the client can tell its reply from a stale one
+    ret['request_id'] = command.get('request_id')
+    deadline = time.time() + reply_timeout
+    while True:
+        try:
+            fd = os.open(command['port'], os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            if e.errno in (errno.ENXIO, errno.EINTR) and time.time() < deadline:
+                time.sleep(0.05)
+                continue
+            sys.stderr.write("warning: could not reply on port %s: %s\n" % (command['port'], str(e)))
+            return
+    try:
+        # the reader is there now; blocking writes are fine (a reader
+        # that goes away gets us EPIPE) and replies can exceed PIPE_BUF
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_NONBLOCK)
+        data = json.dumps(ret)
+        while data:
+            try:
+                data = data[os.write(fd, data):]
+            except OSError as e:
+                if e.errno != errno.EINTR: # SIGCHLD may interrupt us
+                    raise
+    except OSError as e:
+        sys.stderr.write("warning: could not reply on port %s: %s\n" % (command['port'], str(e)))
+    finally:
+        os.close(fd)
+
+def heartbeat_file():
+    return pipe_name + '.heartbeat'
+
+def beat():
+    # a client reading a truncated or half written file would take the
+    # manager for unhealthy, so replace it in one step
+    try:
+        write_atomically(heartbeat_file(), '%d' % int(time.time()))
+    except (IOError, OSError) as e:
+        sys.stderr.write("warning: could not write heartbeat: %s\n" % str(e))
+
+def beat_if_due():
+    # only ever called from the command thread
+    global last_beat
+    if time.time() - last_beat >= heartbeat_interval:
+        beat()
+        last_beat = time.time()
 
 def run_jobs():
     global jobs_running
@@ -94,42 +417,117 @@ def run_jobs():
         saturated.acquire()
         proc = subprocess.Popen(job['job'], shell=True)
         running_jobs_table[proc.pid] = job
+        running_procs[proc.pid] = proc
         jobs_running = len(running_jobs_table)
         saturated.release()
         time.sleep(1.) # sleep a bit in case jobs have sequential dependencies
 
 
 def handle_submit_job(command):
-    global current_job_id
+    key = None
+    warning = None
+    if command.get('memoize'):
+        revision = git_revision()
+        key = memo_key(command, revision)
+    if command.get('memoize') and key is None:
+        warning = 'memoization skipped: could not determine git revision of project'
+    ret = None
     jobs_cv.acquire()
-    jid = current_job_id
-    jobs_q.append({'job': command['run'], 'job_id': jid})
-    current_job_id += 1
-    jobs_cv.notify()
+    if key is not None:
+        cache_lock.acquire()
+        evict_cache()
+        if key in results_cache:
+            cache_stats['cache_hits'] += 1
+            ret = {'code': 0, 'status': 'OK', 'job_id': results_cache[key]['job_id'],
+                    'memoized': 'cached', 'completed': results_cache[key]['completed'],
+                    'message': 'job already completed successfully at this revision, not resubmitted'}
+        elif key in inflight_jobs:
+            cache_stats['coalesced'] += 1
+            ret = {'code': 0, 'status': 'OK', 'job_id': inflight_jobs[key], 'memoized': 'coalesced',
+                    'message': 'identical job already queued or running, coalesced onto it'}
+        cache_lock.release()
+    if ret is None:
+        jid = next_job_id()
+        job = {'job': command['run'], 'job_id': jid}
+        if key is not None:
+            job['memo_key'] = key
+            job['memo_hint'] = memo_hint(command, revision)
+            cache_lock.acquire()
+            inflight_jobs[key] = jid
+            cache_lock.release()
+        jobs_q.append(job)
+        jobs_cv.notify()
+        ret = {'code': 0, 'status': 'OK', 'job_id': jid, 'message': 'job submitted successfully'}
+        if warning is not None:
+            ret['warning'] = warning
     jobs_cv.release()
-    ret = {'code': 0, 'status': 'OK', 'job_id': jid, 'message': 'job submitted successfully'}
-    with open(command['port'], 'w') as f:
-        f.write(json.dumps(ret))
+    reply(command, ret)
+
+def handle_stat_job(command):
+    job_id = command['job_id']
+    ret = None
+    jobs_cv.acquire()
+    for job in jobs_q:
+        if job['job_id'] == job_id:
+            ret = {'code': 0, 'status': 'OK', 'job_id': job_id, 'state': 'queued', 'job': job['job']}
+            break
+    saturated.acquire()
+    for job in running_jobs_table.values():
+        if job['job_id'] == job_id:
+            ret = {'code': 0, 'status': 'OK', 'job_id': job_id, 'state': 'running', 'job': job['job']}
+            break
+    cache_lock.acquire()
+    job = find_finished_job(job_id)
+    if ret is None and job is not None:
+        ret = {'code': 0, 'status': 'OK', 'job_id': job_id, 'state': 'finished', 'job': job['job'],
+                'returncode': job['returncode'], 'finished': job['finished']}
+    cache_lock.release()
+    saturated.release()
+    jobs_cv.release()
+    if ret is None:
+        ret = {'code': 5, 'status': 'error', 'job_id': job_id, 'message': 'job not found on this manager'}
+    reply(command, ret)
 
 def handle_stat(command):
     global max_jobs
     global jobs_running
     global running_jobs_table
     global jobs_q
+    if command.get('job_id') is not None:
+        return handle_stat_job(command)
     jobs_cv.acquire()
     queued = str(jobs_q)
     num_queued = len(jobs_q)
+    inflight_hints = set(job.get('memo_hint') for job in jobs_q)
     # prevents jobs from showing up in both job queue and as running
     saturated.acquire()
     jobs_running_list = list(running_jobs_table.values())
     saturated.release()
     jobs_cv.release()
+    inflight_hints.update(job.get('memo_hint') for job in jobs_running_list)
     num_running = jobs_running
+    cache_lock.acquire()
+    num_saved = cache_stats['cache_hits'] + cache_stats['coalesced']
+    memo = {'num_submissions_saved': num_saved, 'cache_hits': cache_stats['cache_hits'],
+            'coalesced': cache_stats['coalesced'], 'num_results_cached': len(results_cache)}
+    cache_lock.release()
     ret = {'code': 0, 'status': 'OK', 'jobs_running': jobs_running_list,
             'num_jobs_running': num_running, 'num_jobs_queued': num_queued,
-            'jobs_queued': queued, 'max_jobs_running': max_jobs}
-    with open(command['port'], 'w') as f:
-        f.write(json.dumps(ret))
+            'jobs_queued': queued, 'max_jobs_running': max_jobs, 'memoization': memo}
+    if command.get('memoize') and 'run' in command:
+        # lets 'submit any' prefer a manager that can likely answer from
+        # its cache. keyed on command and revision only; hashing input
+        # files for every stat would be too slow
+        revision = git_revision()
+        if revision is not None:
+            hint = memo_hint(command, revision)
+            cache_lock.acquire()
+            if any(result.get('hint') == hint for result in results_cache.values()):
+                ret['memoized'] = 'cached'
+            elif hint in inflight_hints:
+                ret['memoized'] = 'coalesced'
+            cache_lock.release()
+    reply(command, ret)
 
 def handle_configure(command):
     global max_jobs
@@ -148,8 +546,7 @@ def handle_configure(command):
         ret['code'] = 2
         ret['status'] = 'error'
         ret['message'] = 'invalid new max jobs running (must be >= 0)'
-    with open(command['port'], 'w') as f:
-        f.write(json.dumps(ret))
+    reply(command, ret)
 
 def handle_cancel(command):
     global jobs_q
@@ -170,11 +567,33 @@ def handle_cancel(command):
     jobs_cv.release()
 
     if success:
+        cache_lock.acquire()
+        for job in jobs_cancelled:
+            key = job.get('memo_key')
+            if key is not None and inflight_jobs.get(key) == job['job_id']:
+                del inflight_jobs[key]
+        cache_lock.release()
         ret = {'code': 0, 'status': 'OK', 'jobs_cancelled': jobs_cancelled}
     else:
         ret = {'code': 3, 'status': 'error', 'requested_job_to_cancel': cancel_id, 'message': 'requested cancellation not found in queue'}
-    with open(command['port'], 'w') as f:
-        f.write(json.dumps(ret))
+    reply(command, ret)
+
+def handle_list_jobs(command):
+    # used by clients to rebuild their job location index
+    jobs_cv.acquire()
+    queued = [job['job_id'] for job in jobs_q]
+    saturated.acquire()
+    running = [job['job_id'] for job in running_jobs_table.values()]
+    saturated.release()
+    jobs_cv.release()
+    cache_lock.acquire()
+    finished = set(finished_jobs.keys())
+    finished.update(result['job_id'] for result in results_cache.values())
+    cache_lock.release()
+    finished = list(finished)
+    ret = {'code': 0, 'status': 'OK', 'manager_id': manager_id,
+            'jobs_queued': queued, 'jobs_running': running, 'jobs_finished': finished}
+    reply(command, ret)
 
 def handle_shutdown(command):
     global jobs_q
@@ -191,27 +610,36 @@ def handle_shutdown(command):
     else:
         do_shutdown = True
         ret = {'code': 0, 'status': 'OK', 'message': 'shutdown successful'}
-    with open(command['port'], 'w') as f:
-        f.write(json.dumps(ret))
+    reply(command, ret)
     if do_shutdown:
         with open(pipe_name, 'w') as pipein:
             pipein.write(json.dumps({'SHUTDOWN': True}))
 
 def handle_invalid(command):
     ret = {'code': 1, 'status': 'error', 'message': 'unknown command'}
-    with open(command['port'], 'w') as f:
-        f.write(json.dumps(ret))
+    reply(command, ret)
 
 def handle_commands():
     handlers = {'submit_job': handle_submit_job,
                 'stat': handle_stat,
                 'configure': handle_configure,
                 'cancel': handle_cancel,
+                'list_jobs': handle_list_jobs,
                 'shutdown': handle_shutdown,
                 }
-    while True:
-        command = commands_q.get(block=True)
-        prehooks(command)
+    while not stopping.is_set():
+        # beat from this thread (not a separate one) so that a handler
+        # stuck on something stops the heartbeat
+        beat_if_due()
+        try:
+            command = commands_q.get(block=True, timeout=heartbeat_interval)
+        except Queue.Empty:
+            continue
+        # only submissions need an up to date project; running prehooks
+        # for every stat made routing ('submit any') pay for a pull/make
+        # on every manager
+        if command['type'] == 'submit_job':
+            prehooks(command)
         if command['type'] not in handlers:
             handle_invalid(command)
         else:
@@ -239,8 +667,27 @@ def receive_commands_forever():
 def main(args):
     global pipe_name
     global max_jobs
+    global manager_id
+    global job_id_file
+    global finished_file
+    global heartbeat_interval
+    global reply_timeout
+    global cache_file
+    global cache_max_entries
+    global cache_max_age
     pipe_name = args.pipe_name
     max_jobs = args.max_jobs
+    manager_id = args.manager_id if args.manager_id is not None else default_manager_id()
+    job_id_file = args.job_id_file
+    heartbeat_interval = args.heartbeat_interval
+    reply_timeout = args.reply_timeout
+    load_job_id()
+    finished_file = args.finished_file
+    load_finished_jobs()
+    cache_file = args.cache_file
+    cache_max_entries = args.cache_max_entries
+    cache_max_age = args.cache_max_age
+    load_cache()
     signal.signal(signal.SIGCHLD, sigchld_handler)
     os.mkfifo(pipe_name) # if this raises an exception, something is wrong and we should die
 
@@ -252,17 +699,40 @@ def main(args):
     job_thread.daemon=True
     job_thread.start()
 
+    reap_thread = threading.Thread(target=reap_jobs)
+    reap_thread.daemon=True
+    reap_thread.start()
+
     try:
         receive_commands_forever()
     except KeyboardInterrupt:
         # TODO: should flush job queue to disk, this kills it with prejudice
         pass
     os.remove(args.pipe_name) # this signals that no manager is running
+    # let the command and reaper threads wind down rather than waking up
+    # mid interpreter teardown
+    stopping.set()
+    reap_q.put(True)
+    reap_thread.join(heartbeat_interval)
+    # hit/coalesce counters are only written out with completions, so
+    # flush whatever accumulated since the last one
+    save_cache()
+    command_thread.join(heartbeat_interval)
+    if os.path.exists(heartbeat_file()):
+        os.remove(heartbeat_file())
 
 
 if __name__=="__main__":
     parser = argparse.ArgumentParser(description="Manage job submissions")
     parser.add_argument('--max-jobs-running', dest='max_jobs', type=int, required=True, help="maximum # of jobs to run at any given time (rest are queued)")
     parser.add_argument('--pipe-name', dest='pipe_name', default='jobs.pipe', help="name of named pipe used for job submission")
+    parser.add_argument('--manager-id', dest='manager_id', default=None, help="prefix for job ids, unique across the cluster (defaults to hostname plus a hash of the pipe's absolute path)")
+    parser.add_argument('--job-id-file', dest='job_id_file', default='jobs.seq', help="file in which the job id sequence # is persisted across restarts")
+    parser.add_argument('--finished-file', dest='finished_file', default='jobs.finished', help="file in which recently finished jobs are persisted across restarts")
+    parser.add_argument('--heartbeat-interval', dest='heartbeat_interval', type=float, default=5., help="seconds between heartbeats written to <pipe-name>.heartbeat")
+    parser.add_argument('--reply-timeout', dest='reply_timeout', type=float, default=10., help="max seconds to wait for a client to read a reply before giving up on it")
+    parser.add_argument('--cache-file', dest='cache_file', default='results.cache', help="file in which results of memoized jobs are persisted across restarts")
+    parser.add_argument('--cache-max-entries', dest='cache_max_entries', type=int, default=10000, help="maximum # of memoized results to keep (oldest evicted first)")
+    parser.add_argument('--cache-max-age', dest='cache_max_age', type=float, default=7*24*60*60, help="maximum age in seconds of a memoized result before it is evicted")
     args = parser.parse_args()
     main(args)
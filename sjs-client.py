@@ -5,15 +5,49 @@ import yaml
 import subprocess
 import shlex
 import json
-import itertools
 import argparse
 import re
 import socket
 import urllib2
 import time
-
-errors = {'eexists': 2}
+import random
+import copy
+import threading
+import select
+import tempfile
+import fcntl
+
+# exit codes of the remote command script; 124 is what timeout(1) exits with
+errors = {'eexists': 2, 'enotrunning': 3, 'eunhealthy': 4, 'eundelivered': 5, 'etimeout': 124}
 all_patts = ['*', 'all']
+WAIT_POLL_INTERVAL = 5. # seconds between polls when waiting on a job
+MAX_INDEX_AGE = 30 * 24 * 60 * 60. # seconds a job stays in the local job index
+MAX_INDEX_ENTRIES = 100000
+MAX_HEALTH_MARK_AGE = 24 * 60 * 60. # seconds before an unhealthy mark is dropped from the health file
+# printed by the remote command script right before it writes to the
+# manager's pipe; a failure after it may still have reached the manager
+DELIVERY_MARKER = 'sjs-delivering'
+
+# defaults for the optional 'timeouts' section of the config
+default_timeouts = {'request_timeout': 30., # max seconds for one round-trip to a manager
+                    'heartbeat_interval': 5., # must match managers' --heartbeat-interval
+                    'missed_beats': 3, # manager is unhealthy after this many missed heartbeats
+                    'submit_budget': 60., # max seconds for 'submit any' including retries
+                    'prehook_timeout': 600., # extra seconds allowed for a submission's --git/--make
+                    'stat_grace': 2., # once one manager answered 'submit any''s stat, max seconds to wait for the rest
+                    }
+
+unhealthy_managers = {} # map manager -> time marked unhealthy (shared between invocations, see record_health)
+health_lock = threading.Lock() # managers are marked from the parallel stat threads too
+output_lock = threading.Lock() # so replies from parallel requests don't interleave
+pending_job_locations = {} # jobs submitted this invocation, not yet written to the job index
+
+class ManagerUnavailable(Exception):
+    # raised when a manager can't be reached or didn't answer in time.
+    # delivered is False when we know the command never reached it
+    def __init__(self, message, delivered=False):
+        Exception.__init__(self, message)
+        self.delivered = delivered
 
 
 def network_retry(func):
@@ -50,24 +84,61 @@ def get_port_from_settings(manager_settings):
     else:
         return None
 
-def build_ssh_command(manager_settings, command, quiet=False):
+def get_timeout(config, name):
+    return config.get('timeouts', {}).get(name, default_timeouts[name])
+
+def has_prehooks(cmd_json):
+    # managers only run --git/--make for submissions
+    return cmd_json['type'] == 'submit_job' and (cmd_json['git'] or cmd_json['make'])
+
+def get_request_timeout(config, cmd_json):
+    timeout = get_timeout(config, 'request_timeout')
+    if has_prehooks(cmd_json):
+        timeout += get_timeout(config, 'prehook_timeout')
+    return timeout
+
+def build_ssh_command(manager_settings, command, quiet=False, connect_timeout=None):
     host = get_host_from_settings(manager_settings)
     port = get_port_from_settings(manager_settings)
     command = "%s '%s'" % (host, command)
     ssh = "ssh -A"
     if port is not None:
         ssh += (" -p %d" % port)
+    if connect_timeout is not None:
+        ssh += (" -o ConnectTimeout=%d" % max(1, int(connect_timeout)))
     if quiet:
         ssh += " -q"
     return build_remote_command(ssh, manager_settings, command)
 
+def call_with_deadline(command, timeout=None):
+    # like subprocess.call(command, shell=True), but kills the command if
+    # it runs for more than timeout seconds and then exits like timeout(1)
+    if timeout is None:
+        return subprocess.call(command, shell=True)
+    deadline = time.time() + timeout
+    proc = subprocess.Popen(command, shell=True)
+    while proc.poll() is None:
+        if time.time() >= deadline:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+            proc.wait()
+            return errors['etimeout']
+        time.sleep(0.1)
+    return proc.returncode
+
 @network_retry
-def run_ssh_command(manager_settings, command, quiet=False):
-    return subprocess.call(build_ssh_command(manager_settings, command, quiet),
-            shell=True)
+def run_ssh_command(manager_settings, command, quiet=False, timeout=None, connect_timeout=None):
+    # timeout bounds the whole command; commands that may legitimately
+    # run long (clones, builds) should only pass connect_timeout
+    if connect_timeout is None:
+        connect_timeout = timeout
+    return call_with_deadline(build_ssh_command(manager_settings, command, quiet,
+        connect_timeout=connect_timeout), timeout)
 
 def build_scp_command(manager_settings, from_file, to_file,
-        recursive=False, quiet=False):
+        recursive=False, quiet=False, connect_timeout=None):
     host = get_host_from_settings(manager_settings)
     port = get_port_from_settings(manager_settings)
     command = "%s %s:%s" % (from_file, host, to_file)
@@ -76,158 +147,542 @@ def build_scp_command(manager_settings, from_file, to_file,
         scp += " -r"
     if port is not None:
         scp += (" -P %d" % port)
+    if connect_timeout is not None:
+        scp += (" -o ConnectTimeout=%d" % max(1, int(connect_timeout)))
     if quiet:
         scp += " -q"
     return build_remote_command(scp, manager_settings, command)
 
 @network_retry
 def run_scp_command(manager_settings, from_file, to_file,
-        recursive=False, quiet=False):
+        recursive=False, quiet=False, connect_timeout=None):
     return subprocess.call(build_scp_command(manager_settings,
-        from_file, to_file, recursive, quiet), shell=True)
+        from_file, to_file, recursive, quiet, connect_timeout), shell=True)
 
-def build_rsync_command(manager_settings, from_file, to_file):
+def build_rsync_command(manager_settings, from_file, to_file, connect_timeout=None):
     host = get_host_from_settings(manager_settings)
     port = get_port_from_settings(manager_settings)
     command = "%s %s:%s" % (from_file.strip('/'), host, to_file)
     rsync = "rsync -rvz"
+    ssh = "ssh"
     if port is not None:
-        rsync += (" -e 'ssh -p %d'" % port)
+        ssh += (" -p %d" % port)
+    if connect_timeout is not None:
+        ssh += (" -o ConnectTimeout=%d" % max(1, int(connect_timeout)))
+    if ssh != "ssh":
+        rsync += (" -e '%s'" % ssh)
     rsync += " --progress"
     return build_remote_command(rsync, manager_settings, command)
 
 @network_retry
-def run_rsync_command(manager_settings, from_file, to_file):
+def run_rsync_command(manager_settings, from_file, to_file, connect_timeout=None):
     return subprocess.call(build_rsync_command(manager_settings,
-        from_file, to_file), shell=True)
-
-def check_exists_remote(settings, check_path, check_flag="-e"):
-    return run_ssh_command(settings, "[ %s %s ]" % (check_flag, check_path),
-            quiet=True) == 0
+        from_file, to_file, connect_timeout), shell=True)
+
+def check_exists_remote(settings, check_path, check_flag="-e", timeout=None):
+    ret = run_ssh_command(settings, "[ %s %s ]" % (check_flag, check_path),
+            quiet=True, timeout=timeout)
+    if ret == errors['etimeout'] or ret == 255:
+        sys.stderr.write("warning: could not reach %s to check %s\n" % (settings['host'], check_path))
+    return ret == 0
+
+def health_file(args):
+    return args.job_index + '.health'
+
+def load_health(args):
+    try:
+        with open(health_file(args), 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {} # no invocation has marked anything yet
+
+def record_health(args, manager, unhealthy):
+    # marks are kept in a file next to the job index, so a sweep that
+    # submits one job per invocation doesn't wait on the same dead manager
+    # every time
+    health_lock.acquire()
+    if unhealthy:
+        unhealthy_managers[manager] = time.time()
+    else:
+        unhealthy_managers.pop(manager, None)
+    try:
+        lock_file = lock_state_file(health_file(args))
+        try:
+            marks = load_health(args)
+            if unhealthy:
+                marks[manager] = unhealthy_managers[manager]
+            else:
+                marks.pop(manager, None)
+            for marked in list(marks.keys()):
+                if time.time() - marks[marked] > MAX_HEALTH_MARK_AGE:
+                    del marks[marked]
+            write_json_atomically(health_file(args), marks)
+        finally:
+            lock_file.close() # releases the lock
+    except (IOError, OSError) as e:
+        sys.stderr.write("warning: could not save manager health to %s: %s\n" % (health_file(args), str(e)))
+    health_lock.release()
+
+def mark_unhealthy(manager, args):
+    record_health(args, manager, True)
+
+def mark_healthy(manager, args):
+    # only touch the file when this clears a mark
+    if manager in unhealthy_managers:
+        record_health(args, manager, False)
+
+def is_marked_unhealthy(manager, config):
+    # give up on a manager for as long as it would take it to prove
+    # itself alive again with fresh heartbeats
+    if manager not in unhealthy_managers:
+        return False
+    window = get_timeout(config, 'heartbeat_interval') * get_timeout(config, 'missed_beats')
+    return time.time() - unhealthy_managers[manager] < window
+
+def communicate_with_deadline(proc, timeout):
+    # python 2 subprocess has no timeouts, so read with select and
+    # kill the process if it overstays
+    deadline = time.time() + timeout
+    chunks = []
+    fd = proc.stdout.fileno()
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+            proc.wait()
+            return ''.join(chunks), True
+        ready, _, _ = select.select([fd], [], [], remaining)
+        if ready:
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    proc.wait()
+    return ''.join(chunks), False
 
 @network_retry
-def run_command(cmd_json, args, parser, config, suppress_output=False):
+def run_command(cmd_json, args, parser, config, suppress_output=False, timeout=None, prefix=''):
+    # prefix is printed in front of the reply; it isn't printed up front
+    # since errors already say which manager they came from
     if args.manager in all_patts:
+        # ask every manager at once, so one slow manager doesn't hold up
+        # the rest, and skip those recently found unhealthy
+        def run_one(manager):
+            manager_args = copy.copy(args)
+            manager_args.manager = manager
+            try:
+                run_command(copy.deepcopy(cmd_json), manager_args, parser, config, timeout=timeout,
+                        prefix='[%s] ' % manager)
+            except Exception as e:
+                # one bad manager shouldn't stop us from hearing from the rest
+                sys.stderr.write("%s\n" % str(e))
+        threads = []
         for manager in config['managers']:
-            args.manager = manager
-            print ('[%s]' % args.manager),
-            run_command(cmd_json, args, parser, config)
+            if is_marked_unhealthy(manager, config):
+                sys.stderr.write("[%s] error: unhealthy recently, skipping\n" % manager)
+                continue
+            thread = threading.Thread(target=run_one, args=(manager,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            # each request is bounded by its own deadline
+            thread.join()
         return
     elif args.manager == 'any':
         raise Exception("'any' should be reserved for job-submission-handling logic; this exception should be unreachable")
 
-    if not handle_check_running(cmd_json, args, parser, config, suppress_output=True):
-        raise Exception("[%s] error: not running!" % args.manager)
+    if timeout is None:
+        timeout = get_request_timeout(config, cmd_json)
+    deadline = time.time() + timeout
+    max_beat_age = get_timeout(config, 'heartbeat_interval') * get_timeout(config, 'missed_beats')
 
     settings = config['managers'][args.manager]
+    # checking that the manager is running and healthy is done in the same
+    # round-trip as the command itself. every step that can block on the
+    # manager is bounded by timeout(1) where available, and the ssh is
+    # additionally killed locally if it overstays
     template = \
 """
-cd %s;
+cd %s || exit %d
+if [ ! -p %s ]; then
+    exit %d
+fi
+beat=$(cat %s 2>/dev/null); beat=${beat:-0}
+if [ $(( $(date +%%s) - beat )) -gt %d ]; then
+    exit %d
+fi
+with_deadline() { if command -v timeout >/dev/null 2>&1; then timeout %d "$@"; else "$@"; fi; }
 if ! mkfifo %s; then
     exit %d
 fi
-echo %s > %s;
-cat %s; # print the return message; this will be piped back to python
+echo %s
+if ! echo %s | with_deadline tee %s > /dev/null; then
+    rm %s; exit %d
+fi
+with_deadline cat %s; # print the return message; this will be piped back to python
+ret=$?
 rm %s # clear the port for later use
+exit $ret
 """
 
-    for port in itertools.count(1):
-        port_fifo = "%d.port" % port
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise ManagerUnavailable("[%s] error: no free port before deadline" % args.manager)
+        # a client that timed out leaves its reply behind, so a port name
+        # must never be reused by a later request; the request id lets us
+        # double check that the reply we read is the one for this request
+        request_id = "%d-%08x" % (os.getpid(), random.getrandbits(32))
+        port_fifo = "%s.port" % request_id
         cmd_json['port'] = port_fifo
+        cmd_json['request_id'] = request_id
         # escaping arbitrary cmd line arguments in bash
         # ref: http://qntm.org/bash
         cmd_json_str = re.escape(json.dumps(cmd_json))
-        script = template % (settings['project_root'], port_fifo, errors['eexists'], cmd_json_str, settings['pipe'], port_fifo, port_fifo)
+        heartbeat = settings['pipe'] + '.heartbeat'
+        script = template % (settings['project_root'], errors['enotrunning'],
+                settings['pipe'], errors['enotrunning'],
+                heartbeat, max_beat_age, errors['eunhealthy'], max(1, int(remaining)),
+                port_fifo, errors['eexists'], DELIVERY_MARKER, cmd_json_str, settings['pipe'],
+                port_fifo, errors['eundelivered'], port_fifo, port_fifo)
         script = script.strip()
-        ssh_command = build_ssh_command(settings, script)
+        ssh_command = build_ssh_command(settings, script, connect_timeout=remaining)
         proc = subprocess.Popen(ssh_command, shell=True, stdout=subprocess.PIPE)
-        procout, procerr = proc.communicate()
-        if not suppress_output: print procout
+        # a little slack so the remote timeout normally fires first and cleans up its port
+        procout, timed_out = communicate_with_deadline(proc, remaining + 5.)
         ret = proc.returncode
+        marker = DELIVERY_MARKER + '\n'
+        delivered = marker in procout
+        if delivered:
+            procout = procout.split(marker, 1)[1]
+        if timed_out:
+            mark_unhealthy(args.manager, args)
+            raise ManagerUnavailable("[%s] error: no reply within %.0fs" % (args.manager, timeout), delivered=delivered)
         if ret == 0:
-            return json.loads(procout)
+            mark_healthy(args.manager, args)
+            if not suppress_output:
+                output_lock.acquire()
+                print prefix + procout
+                output_lock.release()
+            ret = json.loads(procout)
+            if ret.get('request_id') != request_id:
+                raise Exception("[%s] error: got reply to request %s, expected %s" % (args.manager, ret.get('request_id'), request_id))
+            return ret
         elif ret == errors['eexists']:
             # then try a new port of this one was already in use
             continue
+        elif ret == errors['enotrunning']:
+            raise ManagerUnavailable("[%s] error: not running!" % args.manager)
+        elif ret == errors['eunhealthy']:
+            mark_unhealthy(args.manager, args)
+            raise ManagerUnavailable("[%s] error: unhealthy (no heartbeat for over %ds)" % (args.manager, max_beat_age))
+        elif ret == errors['eundelivered']:
+            mark_unhealthy(args.manager, args)
+            raise ManagerUnavailable("[%s] error: manager not reading commands" % args.manager)
+        elif ret == errors['etimeout']:
+            mark_unhealthy(args.manager, args)
+            raise ManagerUnavailable("[%s] error: no reply within %.0fs" % (args.manager, timeout), delivered=True)
+        elif ret == 255:
+            # ssh itself failed: either it never connected, or the
+            # connection dropped and the command may have gone through
+            mark_unhealthy(args.manager, args)
+            if delivered:
+                raise ManagerUnavailable("[%s] error: connection lost after sending command" % args.manager, delivered=True)
+            raise ManagerUnavailable("[%s] error: could not connect" % args.manager)
         else:
             raise Exception("Trying to run command, got error code %d" % ret)
 
+def load_job_index(args):
+    # local index mapping job ids submitted from this machine -> manager
+    if not os.path.exists(args.job_index):
+        return {}
+    try:
+        with open(args.job_index, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError) as e:
+        sys.stderr.write("warning: could not read job index %s: %s\n" % (args.job_index, str(e)))
+        return {}
+
+def lock_state_file(path):
+    # exclusive lock shared by all clients on this machine, held across a
+    # read-modify-write of path; closing the returned file releases it
+    lock_file = open(path + '.lock', 'a')
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
+
+def write_json_atomically(path, obj):
+    # unique tmp file so concurrent clients don't write into each other's
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                    prefix=os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(obj, f)
+        os.rename(tmp_name, path)
+    except (IOError, OSError):
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+def save_job_index(args, index):
+    try:
+        write_json_atomically(args.job_index, index)
+    except (IOError, OSError) as e:
+        sys.stderr.write("warning: could not save job index %s: %s\n" % (args.job_index, str(e)))
+
+def prune_job_index(index):
+    now = time.time()
+    for job_id in list(index.keys()):
+        if now - index[job_id].get('recorded', 0) > MAX_INDEX_AGE:
+            del index[job_id]
+    if len(index) > MAX_INDEX_ENTRIES:
+        oldest_first = sorted(index, key=lambda job_id: index[job_id].get('recorded', 0))
+        for job_id in oldest_first[:len(index) - MAX_INDEX_ENTRIES]:
+            del index[job_id]
+
+def record_job_locations(args, locations):
+    now = time.time()
+    for job_id in locations:
+        locations[job_id]['recorded'] = now
+    # hold a lock across the read-modify-write so concurrent clients
+    # (e.g. several sweeps submitting at once) don't drop each other's jobs
+    try:
+        lock_file = lock_state_file(args.job_index)
+    except IOError as e:
+        sys.stderr.write("warning: could not save job index %s: %s\n" % (args.job_index, str(e)))
+        return
+    try:
+        index = load_job_index(args)
+        index.update(locations)
+        prune_job_index(index)
+        save_job_index(args, index)
+    finally:
+        lock_file.close() # releases the lock
+
+def flush_job_locations(args):
+    # submissions are batched up so a sweep writes the index once, not once per job
+    if len(pending_job_locations) > 0:
+        record_job_locations(args, pending_job_locations)
+        pending_job_locations.clear()
+
+def handle_rebuild_index(cmd_json, args, parser, config):
+    if args.manager == 'any':
+        parser.error('rebuilding the job index requires specific manager or all')
+    managers = config['managers'].keys() if args.manager in all_patts else [args.manager]
+    locations = {}
+    for manager in managers:
+        args.manager = manager
+        cmd_json['type'] = 'list_jobs'
+        # listing jobs shouldn't 'git pull' or 'make' on every manager
+        cmd_json['git'] = False
+        cmd_json['make'] = False
+        try:
+            ret = run_command(cmd_json, args, parser, config, suppress_output=True)
+        except Exception as e:
+            sys.stderr.write("[%s] warning: could not list jobs: %s\n" % (manager, str(e)))
+            continue
+        for state in ['jobs_queued', 'jobs_running', 'jobs_finished']:
+            for job_id in ret[state]:
+                locations[job_id] = {'manager': manager}
+        print "[%s] indexed %d job(s)" % (manager, len(ret['jobs_queued']) + len(ret['jobs_running']) + len(ret['jobs_finished']))
+    record_job_locations(args, locations)
+    return locations
+
+def locate_job(job_id, args, parser, config):
+    index = load_job_index(args)
+    if job_id in index and index[job_id]['manager'] in config['managers']:
+        return index[job_id]['manager']
+    # job ids are prefixed with the manager id, which is the config name
+    # for managers started by this client
+    prefix = job_id.rsplit(':', 1)[0]
+    if prefix in config['managers']:
+        return prefix
+    sys.stderr.write("warning: job %s not in local index, rebuilding from managers\n" % job_id)
+    manager = args.manager
+    args.manager = 'all'
+    locations = handle_rebuild_index(cmd_json_base(args), args, parser, config)
+    args.manager = manager
+    if job_id in locations:
+        return locations[job_id]['manager']
+    parser.error("could not find job %s on any manager" % job_id)
+
+def stat_managers_in_parallel(cmd_json, args, parser, config, managers, timeout):
+    # stat every manager at once so that the time this takes is bounded
+    # by the deadline rather than by the sum over (or slowest of) managers.
+    # once one manager has answered, the rest only get stat_grace more
+    # seconds, so a slow manager costs little when there's a fast one
+    statuses = {}
+    answered = threading.Condition(threading.Lock())
+    pending = [len(managers)]
+    def stat_one(manager):
+        manager_args = copy.copy(args)
+        manager_args.manager = manager
+        status = None
+        try:
+            status = handle_stat(copy.deepcopy(cmd_json), manager_args, parser, config,
+                    suppress_output=True, timeout=timeout)
+        except Exception as e:
+            sys.stderr.write("%s\n" % str(e))
+        answered.acquire()
+        if status is not None:
+            statuses[manager] = status
+        pending[0] -= 1
+        answered.notify()
+        answered.release()
+    for manager in managers:
+        thread = threading.Thread(target=stat_one, args=(manager,))
+        thread.daemon = True
+        thread.start()
+    deadline = time.time() + timeout
+    answered.acquire()
+    while pending[0] > 0 and time.time() < deadline:
+        if len(statuses) > 0:
+            deadline = min(deadline, time.time() + get_timeout(config, 'stat_grace'))
+        answered.wait(deadline - time.time())
+    # anything still running past the deadline is ignored
+    result = dict(statuses)
+    answered.release()
+    return result
+
 def handle_submit_job_any(cmd_json, args, parser, config):
-    best_manager = None
-    most_slots_least_queued = (0, float('inf'))
+    cmd_json['type'] = 'submit_job'
+    budget = get_timeout(config, 'submit_budget')
+    if has_prehooks(cmd_json):
+        # the submission itself may spend up to prehook_timeout on --git/--make
+        budget += get_timeout(config, 'prehook_timeout')
+    budget_deadline = time.time() + budget
+    request_timeout = get_timeout(config, 'request_timeout')
+    submit_timeout = get_request_timeout(config, cmd_json)
+    managers = [manager for manager in config['managers'] if not is_marked_unhealthy(manager, config)]
+    if len(managers) == 0:
+        raise Exception("all managers unhealthy, can't submit job!")
+
+    statuses = stat_managers_in_parallel(cmd_json, args, parser, config, managers,
+            min(request_timeout, budget_deadline - time.time()))
+    candidates = []
     all_managers_0_max = True
-    for manager in config['managers']:
-        args.manager = manager
-        status = handle_stat(cmd_json, args, parser, config, suppress_output=True)
+    for manager in managers:
+        if manager not in statuses:
+            # failed (and if need be marked unhealthy) or too slow to answer
+            continue
+        status = statuses[manager]
         if status['code'] > 0:
-            sys.stderr.write("[%s] warning: manager had error during stating: %s\n" % (args.manager, status['message']))
+            sys.stderr.write("[%s] warning: manager had error during stating: %s\n" % (manager, status['message']))
             continue
         num_slots = status['max_jobs_running'] - status['num_jobs_running']
         all_managers_0_max = all_managers_0_max and status['max_jobs_running'] <= 0
         if num_slots < 0:
-            sys.sdterr.write("[%s] warning: manager running more jobs than has slots\n" % manager)
+            sys.stderr.write("[%s] warning: manager running more jobs than has slots\n" % manager)
             continue
-        num_queued = status['num_jobs_queued']
-        num_slots_num_queued = (-num_slots, num_queued)
-        if num_slots_num_queued < most_slots_least_queued:
-            # try to run on a manager with a free slot.
-            # if that fails, try to run on manager with shortest queue
-            most_slots_least_queued = num_slots_num_queued
-            best_manager = manager
-
-    if best_manager is None:
+        # prefer a manager that already has (or is running) an identical
+        # job, since it can answer without running anything new. otherwise
+        # try to run on a manager with a free slot, and if that fails, try
+        # to run on manager with shortest queue
+        not_memoized = status.get('memoized') is None
+        candidates.append(((not_memoized, -num_slots, status['num_jobs_queued']), manager))
+
+    if len(candidates) == 0:
         raise Exception("all managers have errors, can't submit job!")
-    if all_managers_0_max:
+    candidates.sort()
+    if all_managers_0_max and candidates[0][0][0]:
         raise Exception("all managers accepting at most 0 jobs, can't submit job!")
 
-    args.manager = best_manager
-    print ('[%s]' % args.manager),
-    return handle_submit_job_nocheck_status(cmd_json, args, parser, config)
-
-def handle_submit_job_nocheck_status(cmd_json, args, parser, config):
+    for _, manager in candidates:
+        remaining = budget_deadline - time.time()
+        if remaining <= 0:
+            break
+        args.manager = manager
+        try:
+            return handle_submit_job_nocheck_status(cmd_json, args, parser, config,
+                    timeout=min(submit_timeout, remaining), prefix='[%s] ' % args.manager)
+        except ManagerUnavailable as e:
+            if e.delivered:
+                # the manager may have queued the job without us hearing
+                # back; submitting elsewhere could run it twice
+                raise Exception("%s; job may have been submitted, not retrying elsewhere" % str(e))
+            sys.stderr.write("%s; retrying on another manager\n" % str(e))
+    raise Exception("could not submit job within %.0fs budget!" % budget)
+
+def handle_submit_job_nocheck_status(cmd_json, args, parser, config, timeout=None, prefix=''):
     cmd_json['type'] = 'submit_job'
     # this function does not do a status check before submission
     # as with handle_job, it assumes cmd_json['run'] is set
-    return run_command(cmd_json, args, parser, config)
+    ret = run_command(cmd_json, args, parser, config, timeout=timeout, prefix=prefix)
+    if ret is not None and ret['code'] == 0:
+        pending_job_locations[ret['job_id']] = {'manager': args.manager,
+            'command': cmd_json['run'], 'submitted': time.time()}
+    return ret
 
-def handle_submit_job(cmd_json, args, parser, config):
+def handle_submit_job(cmd_json, args, parser, config, prefix=''):
     cmd_json['type'] = 'submit_job'
     # this function assumes cmd_json['run'] already set
 
     if args.manager in all_patts:
         for manager in config['managers']:
             args.manager = manager
-            print ("[%s]" % manager),
-            handle_submit_job(cmd_json, args, parser, config)
+            handle_submit_job(cmd_json, args, parser, config, prefix='[%s] ' % manager)
     elif args.manager == 'any':
         return handle_submit_job_any(cmd_json, args, parser, config)
     else:
         status = handle_stat(cmd_json, args, parser, config, suppress_output=True)
         if status['max_jobs_running'] <= 0:
             print '[%s] warning: manager accepting at most 0 jobs, job will be queued' % args.manager
-        return handle_submit_job_nocheck_status(cmd_json, args, parser, config)
+        return handle_submit_job_nocheck_status(cmd_json, args, parser, config, prefix=prefix)
 
 def handle_submit_job_entrypoint(cmd_json, args, parser, config):
     cmd_json['type'] = 'submit_job'
     if args.cmd is None and args.cmd_file is None:
         parser.error("command type %s requires either cmd or file" % args.type)
     manager = args.manager
-    if args.cmd is not None:
-        cmd_json['run'] = args.cmd
-        handle_submit_job(cmd_json, args, parser, config)
-    if args.cmd_file is not None:
-        with open(args.cmd_file, 'r') as f:
-            for line in f:
-                args.manager = manager # since this gets fiddled with
-                # TODO: maybe pass deep copies further down
-                cmd_json['run'] = line
-                handle_submit_job(cmd_json, args, parser, config)
-
-def handle_stat(cmd_json, args, parser, config, suppress_output=False):
+    try:
+        if args.cmd is not None:
+            cmd_json['run'] = args.cmd
+            handle_submit_job(cmd_json, args, parser, config)
+        if args.cmd_file is not None:
+            with open(args.cmd_file, 'r') as f:
+                for line in f:
+                    args.manager = manager # since this gets fiddled with
+                    # TODO: maybe pass deep copies further down
+                    cmd_json['run'] = line
+                    handle_submit_job(cmd_json, args, parser, config)
+    finally:
+        # record whatever did get submitted, even if a later submission failed
+        flush_job_locations(args)
+
+def handle_stat(cmd_json, args, parser, config, suppress_output=False, timeout=None):
     cmd_json['type'] = 'stat'
     if args.manager == 'any':
         parser.error("this doesn't make sense; stating should be specific")
-    return run_command(cmd_json, args, parser, config, suppress_output)
+    return run_command(cmd_json, args, parser, config, suppress_output, timeout=timeout)
+
+def handle_stat_entrypoint(cmd_json, args, parser, config):
+    if args.jid is None or args.jid in all_patts:
+        return handle_stat(cmd_json, args, parser, config)
+    # stat of a single job goes straight to the manager that has it
+    prefix = ''
+    if args.manager == 'any' or args.manager in all_patts:
+        args.manager = locate_job(args.jid, args, parser, config)
+        prefix = '[%s] ' % args.manager
+    cmd_json['type'] = 'stat'
+    cmd_json['job_id'] = args.jid
+    return run_command(cmd_json, args, parser, config, prefix=prefix)
+
+def handle_wait(cmd_json, args, parser, config):
+    if args.jid is None or args.jid in all_patts:
+        parser.error("need to specify a single job id to wait on")
+    if args.manager == 'any' or args.manager in all_patts:
+        args.manager = locate_job(args.jid, args, parser, config)
+    cmd_json['type'] = 'stat'
+    cmd_json['job_id'] = args.jid
+    while True:
+        ret = run_command(cmd_json, args, parser, config, suppress_output=True)
+        if ret['code'] > 0 or ret['state'] == 'finished':
+            print '[%s] %s' % (args.manager, json.dumps(ret))
+            return ret
+        time.sleep(WAIT_POLL_INTERVAL)
 
 def handle_configure(cmd_json, args, parser, config):
     cmd_json['type'] = 'configure'
@@ -240,23 +695,31 @@ def handle_configure(cmd_json, args, parser, config):
 
 def handle_cancel(cmd_json, args, parser, config):
     cmd_json['type'] = 'cancel'
-    if args.jid_cancel is None:
+    if args.jid is None:
         parser.error("need to specify job id to cancel")
-    if args.manager == 'any' or args.manager in all_patts:
-        # TODO: make job ids unique across all managers, then maybe 'any' makes sense
-        parser.error("job cancellation requires specific manager")
-    if args.jid_cancel not in all_patts:
-        args.jid_cancel = int(args.jid_cancel)
-    cmd_json['job_to_cancel'] = args.jid_cancel
-    return run_command(cmd_json, args, parser, config)
-
-def tmux_and_start(settings, args):
+    prefix = ''
+    if args.jid in all_patts:
+        if args.manager == 'any':
+            parser.error("cancelling all jobs requires specific manager or all")
+    elif args.manager == 'any' or args.manager in all_patts:
+        # job ids are unique across managers, so go straight to the one that has it
+        args.manager = locate_job(args.jid, args, parser, config)
+        prefix = '[%s] ' % args.manager
+    cmd_json['job_to_cancel'] = args.jid
+    return run_command(cmd_json, args, parser, config, prefix=prefix)
+
+def tmux_and_start(settings, args, config):
+    timeout = get_timeout(config, 'request_timeout')
+    if args.make:
+        timeout += get_timeout(config, 'prehook_timeout')
     return run_ssh_command(settings,
         ("export PATH=\"$PATH\":/usr/local/bin; cd %s; " + ("make; " if args.make else "") + \
                 "tmux new -s %s -d; tmux send -t %s:0 " + \
-                "\"./job_manager.py --max-jobs-running %d\" ENTER;") % \
+                "\"./job_manager.py --max-jobs-running %d --manager-id %s --heartbeat-interval %s\" ENTER;") % \
         (settings['project_root'], args.manager, 
-            args.manager, settings['default_max_jobs'])) == 0
+            args.manager, settings['default_max_jobs'], args.manager,
+            get_timeout(config, 'heartbeat_interval')),
+        timeout=timeout) == 0
 
 def handle_deploy(cmd_json, args, parser, config):
     # TODO: this one is different; maybe should have different method signature
@@ -268,18 +731,19 @@ def handle_deploy(cmd_json, args, parser, config):
         parser.error('deployment requires specific manager or all')
     else:
         settings = config['managers'][args.manager]
-        if check_exists_remote(settings, settings['project_root']):
+        request_timeout = get_timeout(config, 'request_timeout')
+        if check_exists_remote(settings, settings['project_root'], timeout=request_timeout):
             sys.stderr.write("[%s] warning: already deployed. will update job manager unless running\n" % args.manager)
         else:
             run_ssh_command(settings,
                 "git clone %s %s" % (config['deployment']['project_url'],
-                    settings['project_root']))
+                    settings['project_root']), connect_timeout=request_timeout)
         if handle_check_running(cmd_json, args, parser, config, suppress_output=True):
             sys.stderr.write("[%s] error: already deployed, already running\n" % args.manager)
             return
         run_scp_command(settings,
-            './job_manager.py', settings['project_root'])
-        if tmux_and_start(settings, args):
+            './job_manager.py', settings['project_root'], connect_timeout=request_timeout)
+        if tmux_and_start(settings, args, config):
             print "[%s] startup successful" % args.manager
         else:
             sys.stderr.write("[%s] something went wrong on start!\n" % args.manager)
@@ -294,7 +758,8 @@ def handle_check_running(cmd_json, args, parser, config, suppress_output=False):
     settings = config['managers'][args.manager]
     check_path = os.path.join(settings['project_root'], settings['pipe'])
     # check for existence of named pipe
-    is_running = check_exists_remote(settings, check_path, "-p")
+    is_running = check_exists_remote(settings, check_path, "-p",
+            timeout=get_timeout(config, 'request_timeout'))
     if not suppress_output:
         if is_running:
             print "[%s] I am running" % args.manager
@@ -323,7 +788,8 @@ def handle_force(cmd_json, args, parser, config):
                         (args.manager, num_jobs_running))
                 return
         run_ssh_command(settings,
-                "cd %s; %s" % (settings['project_root'], args.cmd))
+                "cd %s; %s" % (settings['project_root'], args.cmd),
+                connect_timeout=get_timeout(config, 'request_timeout'))
 
 def handle_upload_data(cmd_json, args, parser, config):
     dataset = args.dataset
@@ -345,10 +811,11 @@ def handle_upload_data(cmd_json, args, parser, config):
         datapath = config['managers'][args.manager]['datadir']
         upload_dataset = config['deployment']['datasets'][args.dataset]
         check_path = os.path.join(datapath, os.path.basename(upload_dataset))
-        if check_exists_remote(settings, check_path):
+        request_timeout = get_timeout(config, 'request_timeout')
+        if check_exists_remote(settings, check_path, timeout=request_timeout):
             sys.stderr.write("[%s] warning: path %s already exists, skipping\n" % (args.manager, check_path))
             return
-        if run_rsync_command(settings, upload_dataset, datapath) != 0:
+        if run_rsync_command(settings, upload_dataset, datapath, connect_timeout=request_timeout) != 0:
             sys.stderr.write("[%s] warning: something went wrong calling rsync to path %s" % (args.manager, datapath))
             return
 
@@ -365,10 +832,11 @@ def handle_start(cmd_json, args, parser, config):
             return
         settings = config['managers'][args.manager]
         project = settings['project_root']
-        if not check_exists_remote(settings, settings['project_root']):
+        if not check_exists_remote(settings, settings['project_root'],
+                timeout=get_timeout(config, 'request_timeout')):
             sys.stderr.write("[%s] error: not deployed to project root %s yet\n" % (args.manager, project))
             return
-        if tmux_and_start(settings, args):
+        if tmux_and_start(settings, args, config):
             print "[%s] startup successful" % args.manager
         else:
             sys.stderr.write("[%s] something went wrong on start!" % args.manager)
@@ -392,29 +860,36 @@ def handle_shutdown(cmd_json, args, parser, config):
         else:
             cmd_json['type'] = 'shutdown'
             settings = config['managers'][args.manager]
-            print ("[%s]" % args.manager),
-            ret = run_command(cmd_json, args, parser, config)
+            ret = run_command(cmd_json, args, parser, config, prefix='[%s] ' % args.manager)
             # TODO: there may be a race here
             run_ssh_command(settings,
                 "export PATH=\"$PATH\":/usr/local/bin; " + \
-                        "tmux kill-session -t %s;" % args.manager)
+                        "tmux kill-session -t %s;" % args.manager,
+                timeout=get_timeout(config, 'request_timeout'))
             return ret
 
 
+def cmd_json_base(args):
+    return {'type': args.type, 'git': args.git, 'make': args.make}
+
 def main(args):
     with open(args.config) as f:
         config = yaml.safe_load(f)
+    unhealthy_managers.update(load_health(args))
 
     if args.type not in command_type_handle:
         parser.error("Command type must be one of %s" % command_type_handle.keys())
 
-    cmd_json = {'type': args.type, 'git': args.git, 'make': args.make}
+    cmd_json = cmd_json_base(args)
+    if args.memoize:
+        cmd_json['memoize'] = True
+        cmd_json['inputs'] = args.input_files or []
     command_type_handle[args.type](cmd_json, args, parser, config)
 
 if __name__=="__main__":
     command_type_handle = {
             'submit': handle_submit_job_entrypoint, 
-            'stat': handle_stat, 
+            'stat': handle_stat_entrypoint,
             'configure': handle_configure,
             'cancel': handle_cancel,
             'deploy': handle_deploy,
@@ -423,17 +898,22 @@ if __name__=="__main__":
             'check-running': handle_check_running,
             'start': handle_start,
             'shutdown': handle_shutdown,
+            'wait': handle_wait,
+            'rebuild-index': handle_rebuild_index,
             }
     parser = argparse.ArgumentParser(description="Client for talking to job managers.")
-    parser.add_argument('type', help="type of command to run -- either submit (to submit job), stat (stat current jobs), configure (set manager parameters), cancel (cancel jobs), deploy (deploy job managers from config), force (run command immediately), upload-data (upload data to managers), check-running (self-explanatory), start, or shutdown")
+    parser.add_argument('type', help="type of command to run -- either submit (to submit job), stat (stat current jobs), configure (set manager parameters), cancel (cancel jobs), deploy (deploy job managers from config), force (run command immediately), upload-data (upload data to managers), check-running (self-explanatory), start, shutdown, wait (wait for a job to finish), or rebuild-index (rebuild local job location index from managers)")
     parser.add_argument('manager', help="which job manager to run command on. special are all, any (any tries to find non-saturated manager)")
     parser.add_argument('--config', dest='config', default='config.yaml', help="yaml config file with job manager locations. see example for format")
     parser.add_argument('--command', dest='cmd', default=None, help="if type is submit, the command to run as a job")
-    parser.add_argument('--jid', dest='jid_cancel', default=None, help="if type is cancel, which job to cancel ('all' cancels all jobs)")
+    parser.add_argument('--jid', dest='jid', default=None, help="if type is cancel, which job to cancel ('all' cancels all jobs); if type is stat or wait, which job to stat or wait on")
     parser.add_argument('--command-file', dest='cmd_file', default=None, help="if type is submit, the newline-separated file of commands to run")
     parser.add_argument('--max-jobs-running', dest='max_jobs', type=int, default=None, help="if type is configure, new maximum # of jobs running")
     parser.add_argument('--git', dest='git', default=False, action='store_true', help="whether to do a 'git pull' before executing commands")
     parser.add_argument('--make', dest='make', default=False, action='store_true', help="whether to do a 'make' before executing commands")
+    parser.add_argument('--memoize', dest='memoize', default=False, action='store_true', help="if type is submit, skip jobs that already succeeded at the same git revision (and coalesce identical queued/running jobs)")
+    parser.add_argument('--input-file', dest='input_files', default=None, action='append', help="if type is submit with --memoize, a file (relative to project root) whose contents are part of the memoization key; may be repeated")
+    parser.add_argument('--job-index', dest='job_index', default=os.path.expanduser('~/.sjs-job-index.json'), help="local file mapping job ids submitted from this machine to their managers")
     parser.add_argument('--dataset', dest='dataset', default='all', help="which dataset(s) to copy to specified manager")
     args = parser.parse_args()
     main(args)